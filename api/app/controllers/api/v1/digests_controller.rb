@@ -0,0 +1,106 @@
+class Api::V1::DigestsController < Api::V1::BaseController
+  skip_before_action :authenticate_user!
+  before_action :authenticate_bot!
+
+  # GET /api/v1/digests/weekly
+  # Траты по категориям за неделю и предыдущую неделю для всех пользователей,
+  # включивших дайджест и ещё не получивших его за эту неделю.
+  # Одна агрегирующая выборка на весь батч пользователей.
+  def weekly
+    current_from = params[:week_start].present? ? Date.iso8601(params[:week_start]) : Date.current.beginning_of_week - 1.week
+    current_to = current_from + 6.days
+    previous_from = current_from - 1.week
+    previous_to = current_from - 1.day
+
+    users = User
+      .weekly_digest_due(current_from)
+      .pluck(:telegram_id, :language_code, :base_currency)
+
+    current_sum = Transaction.sanitize_sql_array([
+      'SUM(CASE WHEN transactions.date >= ? THEN transactions.amount ELSE 0 END)', current_from
+    ])
+    previous_sum = Transaction.sanitize_sql_array([
+      'SUM(CASE WHEN transactions.date < ? THEN transactions.amount ELSE 0 END)', current_from
+    ])
+
+    # Только счета в базовой валюте пользователя, как и в аналитике.
+    # Строки пользователей, изменивших настройку между двумя запросами,
+    # бот отбрасывает сам по списку users
+    rows = Transaction
+      .expense
+      .excluding_transfers
+      .joins(:category, account: :user)
+      .merge(User.weekly_digest_due(current_from))
+      .where('accounts.currency = users.base_currency')
+      .where(date: previous_from..current_to)
+      .group('users.telegram_id', 'categories.name', 'categories.icon')
+      .pluck('users.telegram_id', 'categories.name', 'categories.icon', Arel.sql(current_sum), Arel.sql(previous_sum))
+
+    # Колоночный формат: бот агрегирует массивы целиком, без цикла по пользователям
+    render json: {
+      period: {
+        current_from: current_from,
+        current_to: current_to,
+        previous_from: previous_from,
+        previous_to: previous_to
+      },
+      users: users.map do |telegram_id, language_code, base_currency|
+        { telegram_id: telegram_id, language_code: language_code, base_currency: base_currency }
+      end,
+      rows: {
+        telegram_id: rows.map { |row| row[0] },
+        category: rows.map { |row| row[1] },
+        icon: rows.map { |row| row[2] },
+        current: rows.map { |row| row[3].to_f },
+        previous: rows.map { |row| row[4].to_f }
+      }
+    }
+  rescue Date::Error
+    render_invalid_week_start
+  end
+
+  # POST /api/v1/digests/weekly/delivered
+  # Отмечает, что дайджест за неделю week_start доставлен пользователям telegram_ids
+  def mark_delivered
+    week_start = Date.iso8601(params.require(:week_start))
+    telegram_ids = Array(params[:telegram_ids])
+
+    updated = User
+      .where(telegram_id: telegram_ids)
+      .where('users.last_digest_week IS NULL OR users.last_digest_week < ?', week_start)
+      .update_all(last_digest_week: week_start)
+
+    render json: { updated: updated }
+  rescue Date::Error, ActionController::ParameterMissing
+    render_invalid_week_start
+  end
+
+  # PATCH /api/v1/digests/weekly/subscription
+  # Включает или выключает дайджест для существующего пользователя
+  def update_subscription
+    user = User.find_by(telegram_id: params[:telegram_id])
+    return render_not_found('User') unless user
+
+    if user.update(weekly_digest_enabled: ActiveModel::Type::Boolean.new.cast(params[:enabled]) || false)
+      render json: { weekly_digest_enabled: user.weekly_digest_enabled }
+    else
+      render_validation_errors(user)
+    end
+  end
+
+  private
+
+  def render_invalid_week_start
+    render json: { error: 'Invalid week_start, expected YYYY-MM-DD' }, status: :bad_request
+  end
+
+  def authenticate_bot!
+    bot_token = ENV['TELEGRAM_BOT_TOKEN']
+    provided = request.headers['X-Bot-Token']
+
+    unless bot_token.present? && provided.present? &&
+        ActiveSupport::SecurityUtils.secure_compare(provided, bot_token)
+      render_unauthorized
+    end
+  end
+end
@@ -18,6 +18,13 @@ class User < ApplicationRecord
   validates :name, presence: true, length: { minimum: 2 }
   validates :base_currency, presence: true
 
+  # Пользователи с включённым дайджестом, которым ещё не доставлен дайджест за неделю week_start
+  scope :weekly_digest_due, ->(week_start) {
+    where(weekly_digest_enabled: true)
+      .where.not(telegram_id: nil)
+      .where('users.last_digest_week IS NULL OR users.last_digest_week < ?', week_start)
+  }
+
   # Пользователь должен иметь либо email, либо telegram_id
   validate :must_have_email_or_telegram_id
 
@@ -1,4 +1,4 @@
 class UserSerializer < ActiveModel::Serializer
-  attributes :id, :name, :email, :base_currency, :language_code, :created_at
+  attributes :id, :name, :email, :base_currency, :language_code, :weekly_digest_enabled, :created_at
   has_many :accounts
 end
\ No newline at end of file
@@ -51,6 +51,11 @@ Rails.application.routes.draw do
       get '/analytics/comparison', to: 'analytics#comparison'
       get '/analytics/insights', to: 'analytics#insights'
 
+      # Weekly digest for the Telegram bot (bulk, authenticated by bot token)
+      get '/digests/weekly', to: 'digests#weekly'
+      post '/digests/weekly/delivered', to: 'digests#mark_delivered'
+      patch '/digests/weekly/subscription', to: 'digests#update_subscription'
+
       # User Data Management
       delete '/user_data', to: 'user_data#destroy_all'
 
@@ -0,0 +1,6 @@
+class AddWeeklyDigestEnabledToUsers < ActiveRecord::Migration[8.0]
+  def change
+    add_column :users, :weekly_digest_enabled, :boolean, default: false, null: false
+    add_index :users, :weekly_digest_enabled
+  end
+end
@@ -0,0 +1,6 @@
+class AddLastDigestWeekToUsers < ActiveRecord::Migration[8.0]
+  def change
+    # Начало последней недели, дайджест за которую доставлен пользователю
+    add_column :users, :last_digest_week, :date
+  end
+end
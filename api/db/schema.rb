@@ -10,7 +10,7 @@
 #
 # It's strongly recommended that you check this file into your version control system.
 
-ActiveRecord::Schema[8.0].define(version: 2025_11_02_091500) do
+ActiveRecord::Schema[8.0].define(version: 2025_11_12_120000) do
   create_table "accounts", force: :cascade do |t|
     t.string "name", null: false
     t.string "account_type", null: false
@@ -93,8 +93,11 @@ ActiveRecord::Schema[8.0].define(version: 2025_11_02_091500) do
     t.string "username"
     t.string "language_code"
     t.string "base_currency", default: "RUB", null: false
+    t.boolean "weekly_digest_enabled", default: false, null: false
+    t.date "last_digest_week"
     t.index ["email"], name: "index_users_on_email", unique: true
     t.index ["telegram_id"], name: "index_users_on_telegram_id", unique: true
+    t.index ["weekly_digest_enabled"], name: "index_users_on_weekly_digest_enabled"
   end
 
   add_foreign_key "accounts", "users"
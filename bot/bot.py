@@ -1,11 +1,21 @@
 import os
+import time
 import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 import aiohttp
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo, CallbackQuery, FSInputFile
+from aiogram.methods import GetUpdates
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo, CallbackQuery, FSInputFile, BufferedInputFile
 from dotenv import load_dotenv
 
+from digest import aggregate_digests, build_chart_spec, chart_key, render_chart
+from health import LoopLagMonitor, create_health_app, start_health_server
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -13,10 +23,48 @@ BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 WEBAPP_URL = os.getenv('WEBAPP_URL', 'https://financetrack21.netlify.app')
 API_URL = os.getenv('API_URL', 'http://localhost:3000')
 
+# Еженедельный дайджест: день недели (0 = понедельник) и час отправки по UTC
+DIGEST_WEEKDAY = int(os.getenv('DIGEST_WEEKDAY', '0'))
+DIGEST_HOUR = int(os.getenv('DIGEST_HOUR', '9'))
+DIGEST_CHART_WORKERS = int(os.getenv('DIGEST_CHART_WORKERS', '2'))
+
+# Сколько дайджестов рендерить и отправлять за один проход
+DIGEST_CHUNK_SIZE = 20
+# Сколько пользователей отмечать доставленными одним запросом
+DIGEST_MARK_BATCH_SIZE = 500
+
+# Health-эндпоинт: порт, порог задержки event loop (секунды),
+# через сколько секунд блокировки петли процесс завершается для перезапуска
+# и через сколько секунд без успешного getUpdates polling считается мёртвым
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8081'))
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '1.0'))
+LOOP_STALL_EXIT = float(os.getenv('LOOP_STALL_EXIT', '60'))
+POLLING_STALE_AFTER = float(os.getenv('POLLING_STALE_AFTER', '60'))
+
+# Пауза между сообщениями массовой рассылки (лимит Telegram ~30 сообщений в секунду)
+BULK_SEND_INTERVAL = 0.05
+
 # Инициализация бота
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Время последнего успешного getUpdates (для проверки готовности)
+last_polling_success = None
+
+@bot.session.middleware()
+async def track_polling(make_request, bot, method):
+    global last_polling_success
+    response = await make_request(bot, method)
+    if isinstance(method, GetUpdates):
+        last_polling_success = time.monotonic()
+    return response
+
+def is_polling() -> bool:
+    return (
+        last_polling_success is not None
+        and time.monotonic() - last_polling_success < POLLING_STALE_AFTER
+    )
+
 # Словарь переводов
 TEXTS = {
     'ru': {
@@ -44,6 +92,7 @@ TEXTS = {
 /why - Зачем нужен учёт финансов
 /tips - Полезные советы
 /language - Сменить язык
+/digest - Еженедельный дайджест трат
 /version - Информация о версии
 /donate - Поддержать проект
 /support - Техническая поддержка
@@ -209,6 +258,15 @@ TEXTS = {
 
 Постараюсь ответить как можно скорее!''',
         'any_message_text': 'Используйте /help для справки или откройте приложение 👇',
+        'digest_enabled': '📬 Еженедельный дайджест включён. Каждую неделю я буду присылать траты по категориям в сравнении с прошлой неделей.\n\nОтключить: /digest',
+        'digest_disabled': '📭 Еженедельный дайджест отключён.\n\nВключить снова: /digest',
+        'digest_error': '❌ Не удалось изменить настройки дайджеста',
+        'digest_no_account': 'Сначала откройте приложение, чтобы создать аккаунт, а затем включите дайджест командой /digest 👇',
+        'digest_title': '📊 Траты за неделю',
+        'digest_total': 'Всего',
+        'digest_chart_title': 'Траты по категориям',
+        'digest_this_week': 'Эта неделя',
+        'digest_last_week': 'Прошлая неделя',
     },
     'en': {
         'start_welcome': '🦉 Welcome to WiseTrack!',
@@ -235,6 +293,7 @@ Click the button below to get started 👇''',
 /why - Why track finances
 /tips - Useful tips
 /language - Change language
+/digest - Weekly spending digest
 /version - Version information
 /donate - Support the project
 /support - Technical support
@@ -400,6 +459,15 @@ If you have questions, found a bug, or have suggestions for improving the app, c
 
 I'll try to respond as soon as possible!''',
         'any_message_text': 'Use /help for reference or open the app 👇',
+        'digest_enabled': '📬 Weekly digest enabled. Every week I will send your spending by category compared with the previous week.\n\nTurn off: /digest',
+        'digest_disabled': '📭 Weekly digest disabled.\n\nTurn on again: /digest',
+        'digest_error': '❌ Failed to update digest settings',
+        'digest_no_account': 'Open the app first to create your account, then turn on the digest with /digest 👇',
+        'digest_title': '📊 Weekly spending',
+        'digest_total': 'Total',
+        'digest_chart_title': 'Spending by category',
+        'digest_this_week': 'This week',
+        'digest_last_week': 'Last week',
     }
 }
 
@@ -409,36 +477,79 @@ def get_text(user_lang: str, key: str) -> str:
     lang = 'ru' if user_lang == 'ru' else 'en'
     return TEXTS[lang].get(key, '')
 
-# Функция для получения языка пользователя из БД
-async def get_user_language(telegram_id: int) -> str:
-    """Получает сохранённый язык пользователя из БД или автоопределяет"""
+# Функция для получения данных пользователя из БД
+async def get_user_data(telegram_id: int) -> dict:
+    """Получает сохранённые данные пользователя из БД.
+
+    Возвращает {} если пользователя нет, None при ошибке API или сети.
+    """
     try:
         async with aiohttp.ClientSession() as session:
             async with session.get(f"{API_URL}/api/v1/users/telegram/{telegram_id}") as response:
                 if response.status == 200:
-                    data = await response.json()
-                    return data.get('language_code', None)
+                    return await response.json()
+                if response.status == 404:
+                    return {}
+                print(f"Error fetching user data: HTTP {response.status}")
     except Exception as e:
-        print(f"Error fetching user language: {e}")
+        print(f"Error fetching user data: {e}")
     return None
 
-# Функция для сохранения языка пользователя в БД
-async def save_user_language(telegram_id: int, language_code: str) -> bool:
-    """Сохраняет выбранный язык пользователя в БД"""
+# Функция для получения языка пользователя из БД
+async def get_user_language(telegram_id: int) -> str:
+    """Получает сохранённый язык пользователя из БД или автоопределяет"""
+    data = await get_user_data(telegram_id)
+    if data:
+        return data.get('language_code', None)
+    return None
+
+# Функция для обновления данных пользователя в БД
+async def update_user_data(telegram_id: int, payload: dict) -> bool:
+    """Сохраняет изменённые поля пользователя в БД"""
     try:
         async with aiohttp.ClientSession() as session:
             async with session.patch(
                 f"{API_URL}/api/v1/users/telegram/{telegram_id}",
-                json={"language_code": language_code}
+                json=payload
             ) as response:
                 return response.status == 200
     except Exception as e:
-        print(f"Error saving user language: {e}")
+        print(f"Error saving user data: {e}")
         return False
 
+# Функция для сохранения языка пользователя в БД
+async def save_user_language(telegram_id: int, language_code: str) -> bool:
+    """Сохраняет выбранный язык пользователя в БД"""
+    return await update_user_data(telegram_id, {"language_code": language_code})
+
 # Кеш для file_id изображений
 welcome_photo_file_id = None
 
+# Кеш file_id графиков дайджеста: одинаковый график загружается один раз
+DIGEST_CHART_CACHE_SIZE = 512
+digest_chart_file_ids = OrderedDict()
+
+# Пул процессов для рендеринга графиков (создаётся в main)
+chart_executor = None
+
+# Общая очередь массовой рассылки
+bulk_send_lock = asyncio.Lock()
+
+async def send_paced(method, **kwargs):
+    """Отправляет сообщение массовой рассылки с паузой между отправками.
+
+    При ответе 429 ждёт retry_after и повторяет отправку.
+    """
+    async with bulk_send_lock:
+        while True:
+            try:
+                result = await method(**kwargs)
+                break
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+        await asyncio.sleep(BULK_SEND_INTERVAL)
+    return result
+
 # Функция для создания кнопки открытия приложения
 def get_webapp_keyboard(lang: str = 'ru', url: str = WEBAPP_URL, show_help: bool = True) -> InlineKeyboardMarkup:
     buttons = [[InlineKeyboardButton(
@@ -675,6 +786,33 @@ async def cmd_support(message: types.Message):
     keyboard = get_webapp_keyboard(lang)
     await message.answer(get_text(lang, 'support_text'), reply_markup=keyboard)
 
+# Команда /digest - Включить/выключить еженедельный дайджест
+@dp.message(Command("digest"))
+async def cmd_digest(message: types.Message):
+    telegram_id = message.from_user.id
+    user = await get_user_data(telegram_id)
+
+    # Не знаем текущее состояние — не переключаем, иначе можно включить вместо выключения
+    if user is None:
+        lang = 'ru' if message.from_user.language_code == 'ru' else 'en'
+        await message.answer(get_text(lang, 'digest_error'))
+        return
+
+    # Дайджест только для существующих аккаунтов
+    if not user:
+        lang = 'ru' if message.from_user.language_code == 'ru' else 'en'
+        await message.answer(get_text(lang, 'digest_no_account'), reply_markup=get_webapp_keyboard(lang))
+        return
+
+    lang = user.get('language_code') or 'en'
+    enabled = not user.get('weekly_digest_enabled', False)
+    success = await set_digest_enabled(telegram_id, enabled)
+
+    if success:
+        await message.answer(get_text(lang, 'digest_enabled' if enabled else 'digest_disabled'))
+    else:
+        await message.answer(get_text(lang, 'digest_error'))
+
 # Обработка всех остальных сообщений
 @dp.message()
 async def handle_any_message(message: types.Message):
@@ -687,11 +825,253 @@ async def handle_any_message(message: types.Message):
         reply_markup=keyboard
     )
 
+# Форматирование суммы: 12 345 RUB
+def format_amount(amount: float, currency: str) -> str:
+    return f"{amount:,.0f}".replace(',', ' ') + f" {currency}"
+
+# Форматирование изменения: +15% / -3%
+def format_change(change: int) -> str:
+    return f"{change:+d}%"
+
+# Текст подписи к графику дайджеста
+def build_digest_caption(digest: dict, lang: str) -> str:
+    currency = digest['currency']
+    lines = [get_text(lang, 'digest_title'), '']
+    for category in digest['categories']:
+        name = f"{category['icon']} {category['name']}".strip()
+        lines.append(
+            f"{name}: {format_amount(category['current'], currency)} ({format_change(category['change'])})"
+        )
+    lines.append('')
+    lines.append(
+        f"{get_text(lang, 'digest_total')}: {format_amount(digest['total_current'], currency)} "
+        f"({format_change(digest['total_change'])})"
+    )
+    return '\n'.join(lines)
+
+# Заголовок авторизации бота для служебных эндпоинтов дайджеста
+def bot_api_headers() -> dict:
+    return {"X-Bot-Token": BOT_TOKEN}
+
+# Получение данных для дайджеста за неделю week_start из API
+async def fetch_weekly_digest(week_start) -> dict:
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"{API_URL}/api/v1/digests/weekly",
+                params={"week_start": week_start.isoformat()},
+                headers=bot_api_headers()
+            ) as response:
+                if response.status == 200:
+                    return await response.json()
+                print(f"Error fetching weekly digest: HTTP {response.status}")
+    except Exception as e:
+        print(f"Error fetching weekly digest: {e}")
+    return None
+
+# Отметка о доставке: этим пользователям дайджест за неделю больше не придёт
+async def mark_digest_delivered(week_start, telegram_ids: list) -> bool:
+    if not telegram_ids:
+        return True
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{API_URL}/api/v1/digests/weekly/delivered",
+                json={"week_start": week_start.isoformat(), "telegram_ids": telegram_ids},
+                headers=bot_api_headers()
+            ) as response:
+                if response.status == 200:
+                    return True
+                print(f"Error marking digest delivered: HTTP {response.status}")
+    except Exception as e:
+        print(f"Error marking digest delivered: {e}")
+    return False
+
+# Включение/выключение дайджеста (эндпоинт доступен только боту)
+async def set_digest_enabled(telegram_id: int, enabled: bool) -> bool:
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.patch(
+                f"{API_URL}/api/v1/digests/weekly/subscription",
+                json={"telegram_id": telegram_id, "enabled": enabled},
+                headers=bot_api_headers()
+            ) as response:
+                return response.status == 200
+    except Exception as e:
+        print(f"Error updating digest subscription: {e}")
+        return False
+
+# Рендеринг графиков в пуле процессов, чтобы не блокировать event loop.
+# Ошибка одного графика не мешает остальным: такие ключи просто отсутствуют в результате
+async def render_charts(specs: dict) -> dict:
+    loop = asyncio.get_running_loop()
+    keys = list(specs)
+    results = await asyncio.gather(*(
+        loop.run_in_executor(chart_executor, render_chart, specs[key]) for key in keys
+    ), return_exceptions=True)
+
+    images = {}
+    for key, result in zip(keys, results):
+        if isinstance(result, BaseException):
+            print(f"Error rendering digest chart {key}: {result!r}")
+        else:
+            images[key] = result
+    return images
+
+# Рендеринг и отправка одной порции дайджестов.
+# Возвращает telegram_id тех, кому дайджест доставлен
+async def send_digest_chunk(digests: list) -> list:
+    # Описания графиков; рендерим только те, которых ещё нет в кеше file_id
+    chart_keys = []
+    pending_specs = {}
+    for digest in digests:
+        lang = 'ru' if digest['language_code'] == 'ru' else 'en'
+        spec = build_chart_spec(
+            digest,
+            get_text(lang, 'digest_chart_title'),
+            get_text(lang, 'digest_this_week'),
+            get_text(lang, 'digest_last_week')
+        )
+        key = chart_key(spec)
+        chart_keys.append(key)
+        if key not in digest_chart_file_ids:
+            pending_specs[key] = spec
+
+    images = await render_charts(pending_specs)
+
+    delivered = []
+    for digest, key in zip(digests, chart_keys):
+        telegram_id = digest['telegram_id']
+        lang = 'ru' if digest['language_code'] == 'ru' else 'en'
+        photo = digest_chart_file_ids.get(key)
+        if photo:
+            digest_chart_file_ids.move_to_end(key)
+        elif key in images:
+            photo = BufferedInputFile(images[key], filename='digest.png')
+        else:
+            # График не отрисовался — пользователь получит дайджест при следующем запуске
+            continue
+
+        try:
+            message = await send_paced(
+                bot.send_photo,
+                chat_id=telegram_id,
+                photo=photo,
+                caption=build_digest_caption(digest, lang),
+                reply_markup=get_webapp_keyboard(lang, show_help=False)
+            )
+        except TelegramForbiddenError as e:
+            # Бот заблокирован или чат удалён — отключаем дайджест, чтобы не повторять отправку
+            print(f"Digest recipient {telegram_id} is unreachable ({e}), disabling digest")
+            await set_digest_enabled(telegram_id, False)
+            continue
+        except TelegramAPIError as e:
+            print(f"Error sending digest to {telegram_id}: {e}")
+            continue
+
+        delivered.append(telegram_id)
+        if key not in digest_chart_file_ids:
+            digest_chart_file_ids[key] = message.photo[-1].file_id
+            if len(digest_chart_file_ids) > DIGEST_CHART_CACHE_SIZE:
+                digest_chart_file_ids.popitem(last=False)
+
+    return delivered
+
+# Рассылка дайджеста за неделю week_start тем, кому он ещё не доставлен.
+# Повторный запуск (например, после перезапуска бота) досылает только недоставленное
+async def send_weekly_digests(week_start):
+    payload = await fetch_weekly_digest(week_start)
+    if not payload:
+        return
+
+    digests = aggregate_digests(payload)
+    print(f"Weekly digest {week_start}: {len(digests)} users")
+
+    # Пользователи без трат за обе недели дайджест не получают — отмечаем их сразу
+    with_digest = {d['telegram_id'] for d in digests}
+    without_digest = [u['telegram_id'] for u in payload.get('users', []) if u['telegram_id'] not in with_digest]
+    for i in range(0, len(without_digest), DIGEST_MARK_BATCH_SIZE):
+        await mark_digest_delivered(week_start, without_digest[i:i + DIGEST_MARK_BATCH_SIZE])
+
+    # Порциями: в памяти одновременно не больше DIGEST_CHUNK_SIZE картинок,
+    # а доставка отмечается после каждой порции
+    sent = 0
+    for i in range(0, len(digests), DIGEST_CHUNK_SIZE):
+        delivered = await send_digest_chunk(digests[i:i + DIGEST_CHUNK_SIZE])
+        await mark_digest_delivered(week_start, delivered)
+        sent += len(delivered)
+
+    print(f"Weekly digest {week_start} sent: {sent}/{len(digests)}")
+
+# Последний наступивший момент рассылки (DIGEST_WEEKDAY, DIGEST_HOUR по UTC)
+def last_digest_run(now: datetime = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    run = now.replace(hour=DIGEST_HOUR, minute=0, second=0, microsecond=0)
+    run -= timedelta(days=(now.weekday() - DIGEST_WEEKDAY) % 7)
+    if run > now:
+        run -= timedelta(days=7)
+    return run
+
+# Неделя (понедельник), дайджест за которую рассылается в момент run:
+# последняя полностью завершившаяся неделя
+def digest_week_start(run: datetime):
+    run_date = run.date()
+    return run_date - timedelta(days=run_date.weekday() + 7)
+
+# Фоновая задача: при запуске досылает дайджест за уже наступившую рассылку,
+# затем раз в неделю рассылает новый
+async def weekly_digest_scheduler():
+    while True:
+        run = last_digest_run()
+        try:
+            await send_weekly_digests(digest_week_start(run))
+        except Exception as e:
+            print(f"Error sending weekly digest: {e}")
+
+        next_run = run + timedelta(days=7)
+        await asyncio.sleep(max(0.0, (next_run - datetime.now(timezone.utc)).total_seconds()))
+
+# Фоновая задача: завершает процесс, если polling перестал получать обновления.
+# Docker (restart: unless-stopped) перезапустит контейнер
+async def polling_watchdog():
+    await asyncio.sleep(POLLING_STALE_AFTER)
+    while True:
+        if not is_polling():
+            print(f"No successful getUpdates for {POLLING_STALE_AFTER}s, exiting for restart")
+            os._exit(1)
+        await asyncio.sleep(POLLING_STALE_AFTER / 4)
+
 # Главная функция запуска бота
 async def main():
+    global chart_executor
+
     print("Bot WiseTrack started!")
     print(f"WebApp URL: {WEBAPP_URL}")
-    await dp.start_polling(bot)
+
+    monitor = LoopLagMonitor(LOOP_LAG_THRESHOLD, exit_after=LOOP_STALL_EXIT)
+    monitor_task = asyncio.create_task(monitor.run())
+    polling_watchdog_task = asyncio.create_task(polling_watchdog())
+    health_runner = await start_health_server(
+        create_health_app(monitor, API_URL, is_polling),
+        HEALTH_PORT
+    )
+    print(f"Health endpoint: http://0.0.0.0:{HEALTH_PORT}/health/live, /health/ready")
+
+    # spawn, а не fork: к моменту первого рендера в процессе уже есть потоки,
+    # и fork может унаследовать захваченные ими блокировки
+    chart_executor = ProcessPoolExecutor(
+        max_workers=DIGEST_CHART_WORKERS,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    digest_task = asyncio.create_task(weekly_digest_scheduler())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        digest_task.cancel()
+        chart_executor.shutdown(wait=False, cancel_futures=True)
+        polling_watchdog_task.cancel()
+        await health_runner.cleanup()
+        monitor_task.cancel()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,138 @@
+import io
+import json
+import hashlib
+
+import numpy as np
+
+# Сколько категорий показывать в дайджесте и на графике
+TOP_CATEGORIES = 5
+
+
+def percent_change(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    """Изменение в процентах, как в /analytics/comparison: 100% если прошлой недели не было.
+
+    Округление половин от нуля, как .round в Ruby (np.round округляет к чётному).
+    """
+    safe_previous = np.where(previous > 0, previous, 1)
+    ratio = (current - previous) / safe_previous * 100
+    rounded = np.sign(ratio) * np.floor(np.abs(ratio) + 0.5)
+    change = np.where(previous > 0, rounded, np.where(current > 0, 100, 0))
+    return change.astype(int)
+
+
+def aggregate_digests(payload: dict, top_n: int = TOP_CATEGORIES) -> list:
+    """Собирает дайджесты для всего батча пользователей из колоночного ответа API.
+
+    Итоги, изменения и сортировка категорий считаются массивами numpy
+    сразу по всем строкам, без цикла по пользователям.
+    """
+    users = payload.get('users', [])
+    rows = payload.get('rows', {})
+    if not users:
+        return []
+
+    user_ids = np.asarray([u['telegram_id'] for u in users], dtype=np.int64)
+    row_ids = np.asarray(rows.get('telegram_id', []), dtype=np.int64)
+    current = np.asarray(rows.get('current', []), dtype=float)
+    previous = np.asarray(rows.get('previous', []), dtype=float)
+    categories = rows.get('category', [])
+    icons = rows.get('icon', [])
+
+    # Индекс пользователя для каждой строки
+    user_order = np.argsort(user_ids)
+    positions = np.searchsorted(user_ids, row_ids, sorter=user_order)
+    user_index = user_order[np.minimum(positions, len(user_ids) - 1)]
+
+    # Строки пользователей, которых нет в users, отбрасываем: иначе searchsorted
+    # припишет их соседнему пользователю
+    known = user_ids[user_index] == row_ids
+    if not known.all():
+        user_index = user_index[known]
+        current = current[known]
+        previous = previous[known]
+        categories = [c for c, k in zip(categories, known) if k]
+        icons = [i for i, k in zip(icons, known) if k]
+
+    n_users = len(users)
+    total_current = np.bincount(user_index, weights=current, minlength=n_users)
+    total_previous = np.bincount(user_index, weights=previous, minlength=n_users)
+    total_change = percent_change(total_current, total_previous)
+    row_change = percent_change(current, previous)
+
+    # Строки по пользователю, внутри — по убыванию трат за текущую неделю
+    row_order = np.lexsort((-current, user_index))
+    counts = np.bincount(user_index, minlength=n_users)
+    groups = np.split(row_order, np.cumsum(counts)[:-1])
+
+    digests = []
+    for i, user in enumerate(users):
+        if total_current[i] == 0 and total_previous[i] == 0:
+            continue
+
+        top = groups[i][:top_n]
+        digests.append({
+            'telegram_id': int(user_ids[i]),
+            'language_code': user.get('language_code'),
+            'currency': user.get('base_currency') or 'RUB',
+            'total_current': float(total_current[i]),
+            'total_previous': float(total_previous[i]),
+            'total_change': int(total_change[i]),
+            'categories': [
+                {
+                    'name': categories[j],
+                    'icon': icons[j] or '',
+                    'current': float(current[j]),
+                    'previous': float(previous[j]),
+                    'change': int(row_change[j])
+                }
+                for j in top
+            ]
+        })
+
+    return digests
+
+
+def build_chart_spec(digest: dict, title: str, current_label: str, previous_label: str) -> tuple:
+    """Описание графика: одинаковые описания дают одинаковую картинку"""
+    categories = digest['categories']
+    return (
+        title,
+        current_label,
+        previous_label,
+        tuple(c['name'] for c in categories),
+        tuple(round(c['current'], 2) for c in categories),
+        tuple(round(c['previous'], 2) for c in categories)
+    )
+
+
+def chart_key(spec: tuple) -> str:
+    """Ключ кеша графика (и его Telegram file_id)"""
+    return hashlib.sha1(json.dumps(spec, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def render_chart(spec: tuple) -> bytes:
+    """Рисует PNG с тратами по категориям: эта неделя против прошлой.
+
+    Выполняется в ProcessPoolExecutor, поэтому matplotlib импортируется
+    только в рабочих процессах.
+    """
+    from matplotlib.figure import Figure
+
+    title, current_label, previous_label, names, current, previous = spec
+
+    fig = Figure(figsize=(6, 1.5 + 0.5 * len(names)), dpi=100)
+    ax = fig.subplots()
+
+    y = np.arange(len(names))
+    ax.barh(y - 0.2, current, height=0.4, label=current_label, color='#6C5CE7')
+    ax.barh(y + 0.2, previous, height=0.4, label=previous_label, color='#C7CEEA')
+    ax.set_yticks(y, names)
+    ax.invert_yaxis()
+    ax.set_title(title)
+    ax.legend(loc='lower right', frameon=False)
+    for side in ('top', 'right'):
+        ax.spines[side].set_visible(False)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
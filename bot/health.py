@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+import aiohttp
+from aiohttp import web
+
+# Как часто измерять задержку event loop (секунды)
+LAG_SAMPLE_INTERVAL = 0.5
+
+
+class LoopLagMonitor:
+    """Измеряет задержку event loop и логирует стек, когда петля заблокирована.
+
+    Корутина run() просыпается каждые interval секунд и считает, насколько
+    позже запланированного она проснулась. Сторожевой поток следит за
+    отметкой последнего пробуждения: если петля не отвечает дольше threshold,
+    он печатает стек потока петли — это и есть код, который её блокирует.
+    Если блокировка длится дольше exit_after, процесс завершается, и Docker
+    (restart: unless-stopped) поднимает контейнер заново.
+    """
+
+    def __init__(self, threshold: float, exit_after: float = None, interval: float = LAG_SAMPLE_INTERVAL):
+        self.threshold = threshold
+        self.exit_after = exit_after
+        self.interval = interval
+        self.lag = 0.0
+        self.last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        threading.Thread(target=self._watchdog, name='loop-lag-watchdog', daemon=True).start()
+
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                self.lag = max(0.0, loop.time() - started - self.interval)
+                self.last_beat = time.monotonic()
+                if self.lag > self.threshold:
+                    print(f"Event loop lag {self.lag:.3f}s (threshold {self.threshold}s)")
+        finally:
+            self._stopped.set()
+
+    def current_lag(self) -> float:
+        """Последняя задержка или текущая, если петля прямо сейчас заблокирована"""
+        stalled = time.monotonic() - self.last_beat - self.interval
+        return max(self.lag, stalled)
+
+    def _watchdog(self):
+        reported = False
+        while not self._stopped.wait(self.interval):
+            stalled = time.monotonic() - self.last_beat - self.interval
+            if stalled <= self.threshold:
+                reported = False
+                continue
+
+            if not reported:
+                # Один стек на каждую блокировку
+                self._dump_loop_stack(stalled)
+                reported = True
+
+            if self.exit_after is not None and stalled > self.exit_after:
+                # Стек этой блокировки уже напечатан выше
+                print(f"Event loop stuck for over {self.exit_after}s, exiting for restart")
+                os._exit(1)
+
+    def _dump_loop_stack(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else '<stack unavailable>\n'
+        print(f"Event loop blocked for {stalled:.2f}s, loop thread stack:\n{stack}", end='')
+
+
+async def check_api(api_url: str, timeout: float = 2.0) -> bool:
+    """Проверяет доступность API через его /up"""
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            async with session.get(f"{api_url}/up") as response:
+                return response.status == 200
+    except Exception:
+        return False
+
+
+def create_health_app(monitor: LoopLagMonitor, api_url: str, is_polling) -> web.Application:
+    """HTTP-приложение с проверками живости и готовности.
+
+    /health/live  — event loop отвечает, задержка не выше порога и polling
+                    получает обновления; это проверяет healthcheck в Docker
+    /health/ready — плюс доступен API (не входит в live, чтобы падение API
+                    не делало бота нездоровым)
+    """
+
+    def loop_status() -> dict:
+        lag = monitor.current_lag()
+        return {'loop_lag': round(lag, 3), 'loop_ok': lag <= monitor.threshold}
+
+    async def live(request: web.Request) -> web.Response:
+        status = loop_status()
+        status['polling_ok'] = is_polling()
+        ok = status['loop_ok'] and status['polling_ok']
+        return web.json_response(status, status=200 if ok else 503)
+
+    async def ready(request: web.Request) -> web.Response:
+        status = loop_status()
+        status['polling_ok'] = is_polling()
+        status['api_ok'] = await check_api(api_url)
+        ok = status['loop_ok'] and status['polling_ok'] and status['api_ok']
+        return web.json_response(status, status=200 if ok else 503)
+
+    app = web.Application()
+    app.router.add_get('/health/live', live)
+    app.router.add_get('/health/ready', ready)
+    return app
+
+
+async def start_health_server(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    return runner
@@ -0,0 +1,38 @@
+import numpy as np
+
+from digest import aggregate_digests, percent_change
+
+
+def make_payload(user_ids, rows):
+    return {
+        'users': [{'telegram_id': i, 'language_code': 'en', 'base_currency': 'RUB'} for i in user_ids],
+        'rows': {
+            'telegram_id': [r[0] for r in rows],
+            'category': [r[1] for r in rows],
+            'icon': ['' for _ in rows],
+            'current': [r[2] for r in rows],
+            'previous': [r[3] for r in rows],
+        }
+    }
+
+
+def test_rows_of_unknown_users_are_dropped():
+    # 15 сортируется между пользователями, 30 — после последнего
+    payload = make_payload([10, 20], [
+        (10, 'Food', 100.0, 50.0),
+        (15, 'Secret', 999.0, 0.0),
+        (30, 'Other', 1.0, 0.0),
+    ])
+
+    digests = aggregate_digests(payload)
+
+    assert [d['telegram_id'] for d in digests] == [10]
+    assert [c['name'] for c in digests[0]['categories']] == ['Food']
+    assert digests[0]['total_current'] == 100.0
+
+
+def test_percent_change_rounds_half_away_from_zero():
+    current = np.array([102.5, 97.5, 5.0, 0.0])
+    previous = np.array([100.0, 100.0, 0.0, 0.0])
+
+    assert percent_change(current, previous).tolist() == [3, -3, 100, 0]
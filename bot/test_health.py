@@ -0,0 +1,114 @@
+import os
+import time
+import asyncio
+import threading
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import health
+from health import LoopLagMonitor, create_health_app
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:test')
+
+import bot  # noqa: E402
+
+
+async def start_monitor(monitor):
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(monitor.interval * 2)
+    return task
+
+
+def test_lag_is_measured_and_stack_dumped_once_per_stall(capsys):
+    async def scenario():
+        monitor = LoopLagMonitor(0.2, interval=0.05)
+        task = await start_monitor(monitor)
+        time.sleep(0.6)
+        lag_while_blocked = monitor.current_lag()
+        await asyncio.sleep(0.2)
+        task.cancel()
+        return lag_while_blocked, monitor
+
+    lag_while_blocked, monitor = asyncio.run(scenario())
+
+    assert lag_while_blocked > 0.4
+    assert monitor.lag < 0.2
+    output = capsys.readouterr().out
+    assert output.count('Event loop blocked for') == 1
+    assert 'test_lag_is_measured_and_stack_dumped_once_per_stall' in output
+
+
+def test_watchdog_exits_after_sustained_stall(monkeypatch, capsys):
+    exited = threading.Event()
+    monitor = LoopLagMonitor(0.1, exit_after=0.3, interval=0.05)
+
+    def fake_exit(code):
+        exited.set()
+        monitor._stopped.set()
+
+    monkeypatch.setattr(health.os, '_exit', fake_exit)
+
+    async def scenario():
+        task = await start_monitor(monitor)
+        time.sleep(0.6)
+        task.cancel()
+
+    asyncio.run(scenario())
+
+    assert exited.is_set()
+    output = capsys.readouterr().out
+    assert output.count('Event loop blocked for') == 1
+    assert 'exiting for restart' in output
+
+
+def request_statuses(monitor, is_polling, api_ok, block=0.0):
+    async def fake_check_api(api_url):
+        return api_ok
+
+    async def scenario():
+        original = health.check_api
+        health.check_api = fake_check_api
+        task = await start_monitor(monitor)
+        try:
+            async with TestClient(TestServer(create_health_app(monitor, 'http://api', is_polling))) as client:
+                if block:
+                    time.sleep(block)
+                live = await client.get('/health/live')
+                ready = await client.get('/health/ready')
+                return live.status, ready.status
+        finally:
+            health.check_api = original
+            task.cancel()
+
+    return asyncio.run(scenario())
+
+
+def test_healthy_bot_is_live_and_ready():
+    monitor = LoopLagMonitor(0.5, interval=0.05)
+    assert request_statuses(monitor, lambda: True, api_ok=True) == (200, 200)
+
+
+def test_api_outage_affects_only_readiness():
+    monitor = LoopLagMonitor(0.5, interval=0.05)
+    assert request_statuses(monitor, lambda: True, api_ok=False) == (200, 503)
+
+
+def test_stale_polling_fails_liveness():
+    monitor = LoopLagMonitor(0.5, interval=0.05)
+    assert request_statuses(monitor, lambda: False, api_ok=True) == (503, 503)
+
+
+def test_blocked_loop_fails_liveness():
+    monitor = LoopLagMonitor(0.2, interval=0.05)
+    assert request_statuses(monitor, lambda: True, api_ok=True, block=0.5) == (503, 503)
+
+
+def test_is_polling_tracks_last_get_updates(monkeypatch):
+    monkeypatch.setattr(bot, 'last_polling_success', None)
+    assert not bot.is_polling()
+
+    monkeypatch.setattr(bot, 'last_polling_success', time.monotonic())
+    assert bot.is_polling()
+
+    monkeypatch.setattr(bot, 'last_polling_success', time.monotonic() - bot.POLLING_STALE_AFTER - 1)
+    assert not bot.is_polling()